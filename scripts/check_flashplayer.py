@@ -1,58 +1,63 @@
 #!/usr/bin/env python3
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from http_client import SESSION
 import json
 import os
 
+# Tags that may reference the player's media URL
+MEDIA_TAGS = ['embed', 'object', 'audio', 'source', 'script']
+
 def check_flashplayer():
     # Example URL from the playlists
     url = "https://www.wfmu.org/flashplayer.php?version=3&show=151390&archive=269366"
     
     try:
         # Download the page
-        response = requests.get(url)
+        response = SESSION.get(url, timeout=10)
         response.raise_for_status()
         
         # Save the raw HTML for inspection
-        with open('flashplayer_content.html', 'w', encoding='utf-8') as f:
-            f.write(response.text)
+        with open('flashplayer_content.html', 'wb') as f:
+            f.write(response.content)
             
-        # Parse HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
+        # Parse only the tags that can carry media URLs
+        strainer = SoupStrainer(MEDIA_TAGS)
+        soup = BeautifulSoup(response.content, 'lxml', parse_only=strainer)
+        
+        # Group the tags by name in a single walk of the tree
+        tags = {name: [] for name in MEDIA_TAGS}
+        for tag in soup.find_all(True):
+            if tag.name in tags:
+                tags[tag.name].append(tag)
         
         # Look for media URLs in various places
         # Look for embed tags
-        embeds = soup.find_all('embed')
         print("\nEmbed tags:")
-        for embed in embeds:
+        for embed in tags['embed']:
             print(f"Embed src: {embed.get('src')}")
             print(f"Embed flashvars: {embed.get('flashvars')}")
             
         # Look for object tags
-        objects = soup.find_all('object')
         print("\nObject tags:")
-        for obj in objects:
+        for obj in tags['object']:
             print(f"Object data: {obj.get('data')}")
             # Look for params inside object
             for param in obj.find_all('param'):
                 print(f"Param {param.get('name')}: {param.get('value')}")
                 
         # Look for audio tags
-        audio = soup.find_all('audio')
         print("\nAudio tags:")
-        for a in audio:
+        for a in tags['audio']:
             print(f"Audio src: {a.get('src')}")
             
         # Look for source tags
-        sources = soup.find_all('source')
         print("\nSource tags:")
-        for source in sources:
+        for source in tags['source']:
             print(f"Source src: {source.get('src')}")
             
         # Look for all scripts
-        scripts = soup.find_all('script')
         print("\nScripts with URLs:")
-        for script in scripts:
+        for script in tags['script']:
             text = script.string
             if text and ('http://' in text or 'https://' in text):
                 print(f"Script content: {text}")
@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 import json
-import vlc
-import time
 import sys
 import os
 import logging
-import requests
-import re
-import subprocess
-import tempfile
 import select
+import threading
+import tempfile
 from datetime import datetime
-from urllib.parse import urlparse, parse_qs
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from http_client import SESSION, POOL_SIZE
+from wfmu_urls import construct_m3u_url, get_s3_url_from_rtmp, show_archive_ids
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Set up logging
 logging.basicConfig(
@@ -21,104 +25,185 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Checkout root, where the scraped playlists and debug HTML live
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Flash player pages resolved to S3 URLs on previous runs, keyed by "show_id:archive_id"
+RESOLVED_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'my_radio', 'resolved.json')
+
+# One probe thread per pooled connection
+PROBE_WORKERS = POOL_SIZE
+
 def load_playlists():
     """Load the playlists from the JSON file."""
     try:
-        json_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "wfmu_playlists.json")
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        json_path = REPO_ROOT / "wfmu_playlists.json"
+        with open(json_path, 'rb') as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
         return data['playlists']
     except Exception as e:
         logging.error(f"Error loading playlists: {e}")
         return []
 
-def list_shows(playlists):
-    """Display available shows."""
+def probe_availability(playlists):
+    """HEAD-probe every show's S3 URL concurrently, returning status codes keyed by show ID."""
+    def probe(show):
+        try:
+            return SESSION.head(show['s3_url'], timeout=5).status_code
+        except Exception:
+            return None
+    
+    probed = [show for show in playlists if show.get('s3_url')]
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+        return dict(zip((show['show_id'] for show in probed), executor.map(probe, probed)))
+
+def list_shows(playlists, availability=None):
+    """Display available shows, marking those whose S3 archive is missing."""
+    availability = availability or {}
     print("\nAvailable shows:")
     for i, show in enumerate(playlists, 1):
-        print(f"{i}. {show['date']} - {show['title']}")
+        status = availability.get(show.get('show_id'), 200)
+        marker = "" if status == 200 else " ✗"
+        print(f"{i}. {show['date']} - {show['title']}{marker}")
     print()
 
-def is_rtmp_url(url):
-    """Check if URL is an RTMP stream."""
-    return url.startswith(('rtmp://', 'rtmpt://', 'rtmps://'))
+def is_available(url):
+    """Check with a HEAD request whether a media URL can be fetched."""
+    try:
+        return SESSION.head(url, timeout=3).status_code == 200
+    except Exception as e:
+        logging.error(f"Error probing {url}: {e}")
+        return False
+
+def get_m3u_url(show):
+    """Return the show's M3U URL, deriving it from the pop-up player URL for older playlist files."""
+    if show.get('m3u_url'):
+        return show['m3u_url']
+    return construct_m3u_url(show.get('popup_listen_url'))
 
 def get_mp3_url_from_m3u(m3u_url):
     """Fetch the MP3 URL from the M3U file."""
     try:
         if not m3u_url:
             return None
-            
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Referer': 'https://www.wfmu.org/'
-        }
-        
-        response = requests.get(m3u_url, headers=headers, timeout=10)
-        response.raise_for_status()
         
-        # Log the response for debugging
-        logging.info(f"M3U Response: {response.text}")
-        
-        # M3U files are simple text files with URLs
-        lines = response.text.strip().split('\n')
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                return line
+        # Stream the M3U file and stop at the first playable URL
+        with SESSION.get(m3u_url, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            
+            # M3U files are simple text files with URLs; only the match is decoded
+            for line in response.iter_lines():
+                line = line.strip()
+                if line and line[0:1] != b'#':
+                    url = line.decode('utf-8', errors='replace')
+                    logging.info(f"M3U stream URL: {url}")
+                    return url
                 
         return None
     except Exception as e:
         logging.error(f"Error fetching M3U file: {e}")
         return None
 
+def _load_resolved_cache():
+    """Load the on-disk cache of resolved S3 URLs."""
+    try:
+        with open(RESOLVED_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_resolved_cache():
+    """Atomically write the resolved S3 URL cache back to disk."""
+    try:
+        cache_dir = os.path.dirname(RESOLVED_CACHE_PATH)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(_resolved_cache, f, indent=2)
+        os.replace(tmp_path, RESOLVED_CACHE_PATH)
+    except OSError as e:
+        logger.warning(f"Could not write resolved URL cache: {e}")
+
+_resolved_cache = _load_resolved_cache()
+
+def _fetch_stream_url(popup_url):
+    """Fetch the Flash player page and build the S3 URL from its audio source."""
+    # Imported here so listing shows doesn't pay for loading lxml
+    from lxml import etree
+    
+    # Extract date from the page to construct filename
+    logger.info("Fetching Flash player page content...")
+    with SESSION.get(popup_url, timeout=10, stream=True) as response:
+        # Feed the body to libxml2 as it arrives
+        parser = etree.HTMLParser()
+        chunks = response.iter_content(chunk_size=8192)
+        if os.environ.get('MYRADIO_DEBUG_HTML'):
+            # Save the raw HTML content for inspection
+            debug_file = REPO_ROOT / "debug_flashplayer.html"
+            with open(debug_file, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    parser.feed(chunk)
+            logger.info(f"Saved raw HTML content to: {debug_file}")
+        else:
+            for chunk in chunks:
+                parser.feed(chunk)
+    
+    if response.status_code == 200:
+        root = parser.close()
+        # Look for the audio source
+        audio_source = root.find('.//source')
+        logger.info(f"Found audio source tag: {audio_source}")
+        
+        if audio_source is not None and audio_source.get('src'):
+            rtmp_url = audio_source.get('src')
+            logger.info(f"Extracted RTMP URL: {rtmp_url}")
+            
+            # Convert the RTMP URL (e.g., mp4:LM/lm250424.mp4) to its S3 URL
+            s3_url = get_s3_url_from_rtmp(rtmp_url)
+            if s3_url:
+                logger.info(f"Constructed S3 URL: {s3_url}")
+                return s3_url
+            else:
+                logger.error("Could not extract filename from RTMP URL")
+        else:
+            logger.error("No audio source tag found or missing src attribute")
+    else:
+        logger.error(f"Failed to fetch Flash player page: {response.status_code}")
+
+    return None
+
+@lru_cache(maxsize=256)
+def _resolve(show_id, archive_id):
+    """Resolve a show/archive pair to its S3 URL, consulting the disk cache first."""
+    key = f"{show_id}:{archive_id}"
+    if key in _resolved_cache:
+        logger.info(f"Using cached S3 URL: {_resolved_cache[key]}")
+        return _resolved_cache[key]
+    
+    popup_url = f"https://www.wfmu.org/flashplayer.php?version=3&show={show_id}&archive={archive_id}"
+    s3_url = _fetch_stream_url(popup_url)
+    if not s3_url:
+        # Raise so that lru_cache does not remember the failure
+        raise LookupError(f"Could not resolve show {show_id}, archive {archive_id}")
+    
+    _resolved_cache[key] = s3_url
+    _save_resolved_cache()
+    return s3_url
+
 def get_stream_url_from_flashplayer(popup_url):
     """Extract the stream URL from the Flash player page."""
     try:
         # First try to construct direct S3 URL
         if 'flashplayer.php' in popup_url:
             logger.info(f"\nProcessing Flash player URL: {popup_url}")
-            parsed = urlparse(popup_url)
-            params = parse_qs(parsed.query)
-            show_id = params.get('show', [''])[0]
-            archive_id = params.get('archive', [''])[0]
+            show_id, archive_id = show_archive_ids(popup_url)
             logger.info(f"Extracted show_id: {show_id}, archive_id: {archive_id}")
             
-            # Extract date from the page to construct filename
-            logger.info("Fetching Flash player page content...")
-            response = requests.get(popup_url)
-            
-            # Save the raw HTML content for inspection
-            debug_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), "debug_flashplayer.html")
-            with open(debug_file, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-            logger.info(f"Saved raw HTML content to: {debug_file}")
-            
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                # Look for the audio source
-                audio_source = soup.find('source')
-                logger.info(f"Found audio source tag: {audio_source}")
-                
-                if audio_source and 'src' in audio_source.attrs:
-                    rtmp_url = audio_source['src']
-                    logger.info(f"Extracted RTMP URL: {rtmp_url}")
-                    
-                    # Extract filename from RTMP URL (e.g., lm250424.mp4)
-                    filename_match = re.search(r'mp4:LM/([^"]+)', rtmp_url)
-                    if filename_match:
-                        filename = filename_match.group(1)
-                        logger.info(f"Extracted filename: {filename}")
-                        # Construct S3 URL
-                        s3_url = f"https://s3.amazonaws.com/arch.wfmu.org/LM/{filename}"
-                        logger.info(f"Constructed S3 URL: {s3_url}")
-                        return s3_url
-                    else:
-                        logger.error("Could not extract filename from RTMP URL")
-                else:
-                    logger.error("No audio source tag found or missing src attribute")
-            else:
-                logger.error(f"Failed to fetch Flash player page: {response.status_code}")
+            if show_id and archive_id:
+                return _resolve(show_id, archive_id)
+            return _fetch_stream_url(popup_url)
 
         return None
     except Exception as e:
@@ -128,6 +213,9 @@ def get_stream_url_from_flashplayer(popup_url):
 def play_stream(url, title):
     """Play a media stream."""
     try:
+        # Imported here because loading libvlc is slow and only playback needs it
+        import vlc
+        
         # Create a VLC instance without verbose logging
         instance = vlc.Instance('--quiet')
         
@@ -148,19 +236,31 @@ def play_stream(url, title):
         print("  p: Play/Pause")
         print("  s: Stop")
         
+        # Wake the control loop from VLC's event thread when playback fails
+        stop_event = threading.Event()
+        wake_r, wake_w = os.pipe()
+        def on_error(event):
+            stop_event.set()
+            os.write(wake_w, b'\0')
+        event_manager = player.event_manager()
+        event_manager.event_attach(vlc.EventType.MediaPlayerEncounteredError, on_error)
+        
         # Start playing
         player.play()
         
-        # Wait a bit to check if playback started
-        time.sleep(2)
-        
-        # Main control loop
-        while True:
-            # Get user input without blocking
-            if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
+        try:
+            # Main control loop
+            while not stop_event.is_set():
+                # Block until the user types a command or VLC reports an error
+                ready = select.select([sys.stdin, wake_r], [], [])[0]
+                if sys.stdin not in ready:
+                    continue
                 cmd = sys.stdin.read(1)
                 
-                if cmd == 'q':
+                if not cmd:
+                    # stdin is closed; keep playing until VLC gives up
+                    stop_event.wait()
+                elif cmd == 'q':
                     print("\nQuitting...")
                     player.stop()
                     break
@@ -175,14 +275,12 @@ def play_stream(url, title):
                     player.stop()
                     print("Stopped")
             
-            # Check if media is playing
-            state = player.get_state()
-            if state == vlc.State.Error:
+            if stop_event.is_set():
                 print("\nError playing stream.")
-                break
-            
-            # Sleep a bit to prevent high CPU usage
-            time.sleep(0.1)
+        finally:
+            event_manager.event_detach(vlc.EventType.MediaPlayerEncounteredError)
+            os.close(wake_r)
+            os.close(wake_w)
             
     except Exception as e:
         logging.error(f"Error playing stream: {e}")
@@ -197,10 +295,13 @@ def main():
         if not playlists:
             print("No playlists found.")
             return
+        
+        # Check which archives exist before listing them
+        availability = probe_availability(playlists)
             
         while True:
             # Show available shows
-            list_shows(playlists)
+            list_shows(playlists, availability)
             
             # Get user choice
             try:
@@ -212,12 +313,26 @@ def main():
                 if 0 <= idx < len(playlists):
                     show = playlists[idx]
                     
-                    # Try to get direct S3 URL first
-                    stream_url = get_stream_url_from_flashplayer(show['popup_listen_url'])
+                    # Try the S3 URL built from the show date first, re-probing only if startup didn't confirm it
+                    stream_url = show.get('s3_url')
+                    if stream_url and availability.get(show.get('show_id')) != 200 and not is_available(stream_url):
+                        stream_url = None
+                    
+                    if not stream_url and show.get('mp4_listen_url') != show.get('s3_url'):
+                        # Use the S3 URL the scraper took from the Flash player page's audio source, unless it's the one that just failed
+                        stream_url = show.get('mp4_listen_url')
+                    
+                    if not stream_url:
+                        # Fall back to scraping the S3 URL from the Flash player page
+                        stream_url = get_stream_url_from_flashplayer(show['popup_listen_url'])
+                    
+                    if not stream_url:
+                        # Use the MP3 URL resolved at scrape time, or fetch it from the M3U file
+                        stream_url = show.get('mp3_url') or get_mp3_url_from_m3u(get_m3u_url(show))
                     
                     if not stream_url:
-                        # Try to get MP3 URL from M3U file as fallback
-                        stream_url = get_mp3_url_from_m3u(show['m3u_url'])
+                        # Last resort: hand the RTMP URL straight to VLC
+                        stream_url = show.get('direct_media_url')
                     
                     if not stream_url:
                         print("No playable URL found for this show.")
@@ -1,238 +1,359 @@
 #!/usr/bin/env python3
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import contextlib
+import httpx
+import lxml.html
+from lxml import etree
+import html
 import json
 import re
-from datetime import datetime
+from datetime import datetime, timezone
 import os
-from urllib.parse import urlparse, parse_qs
+from pathlib import Path
+from http_client import HEADERS
+from wfmu_urls import construct_m3u_url, get_s3_url_from_rtmp, show_archive_ids
 
-def get_media_url_from_flashplayer(popup_url):
-    """Extract the direct media URL and cue start time from the flashplayer.php page."""
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Regular expression to match the date and title format
+_DATE_RE = re.compile(r'([A-Za-z]+ \d+,? (\d{4}))')
+
+# Only list items carrying a pop-up player link and a 19xx/20xx year can be playlist entries;
+# checked inside libxml2 so other items never have their text extracted in Python
+_IS_PLAYLIST_ENTRY = etree.XPath(
+    "boolean(.//a[contains(@href, 'flashplayer.php')]) and (contains(., '20') or contains(., '19'))"
+)
+# Text of the flashplayer page's <textarea id="playlist-data">
+_PLAYLIST_DATA_RE = re.compile(rb'<textarea[^>]*\bid=["\']playlist-data["\'][^>]*>(.*?)</textarea>', re.DOTALL)
+_PLAYLIST_DATA_XPATH = etree.XPath("//textarea[@id='playlist-data']/text()")
+
+# Checkout root, where the scraped JSON and debug HTML are written
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# wfmu.org serves UTF-8 without a <meta charset>, which libxml2 would otherwise read as Latin-1
+PAGE_ENCODING = 'utf-8'
+
+# Used by the full-parse fallback so it decodes like the streaming parser
+_PAGE_PARSER = lxml.html.HTMLParser(encoding=PAGE_ENCODING)
+
+# Upper bound on flashplayer pages and M3U files fetched at once
+MAX_CONCURRENT_REQUESTS = 16
+
+# Entry fields filled in from the flashplayer page and M3U file
+RESOLVED_FIELDS = ("direct_media_url", "mp4_listen_url", "mp3_url", "cue_start")
+
+def _text(element):
+    """Return the element's text with each fragment stripped, like BeautifulSoup's get_text(strip=True)."""
+    return ''.join(fragment.strip() for fragment in element.itertext())
+
+def _find_playlist_data(content):
+    """Return the text of the playlist-data textarea, or None if the page has none."""
+    match = _PLAYLIST_DATA_RE.search(content)
+    if match:
+        return html.unescape(match.group(1).decode(PAGE_ENCODING, errors='replace'))
+    # Fall back to a full parse if the markup isn't shaped as expected
+    playlist_data = _PLAYLIST_DATA_XPATH(lxml.html.fromstring(content, parser=_PAGE_PARSER))
+    return playlist_data[0] if playlist_data else None
+
+def parse_flashplayer_page(content):
+    """Extract the direct media URL and cue start time from the flashplayer.php page content."""
+    # Find the playlist-data textarea
+    playlist_data = _find_playlist_data(content)
+    if playlist_data is None:
+        return "", None
+    # Parse the JSON data
+    try:
+        data = json.loads(playlist_data.strip())
+        cue_start = None
+        # Prefer the offset field in top-level @attributes
+        if '@attributes' in data and 'offset' in data['@attributes']:
+            cue_start = data['@attributes']['offset']
+        # Fallbacks: check audio attributes for cue/start
+        if cue_start is None and 'audio' in data and '@attributes' in data['audio']:
+            cue_start = data['audio']['@attributes'].get('cue')
+            if cue_start is None:
+                cue_start = data['audio']['@attributes'].get('start')
+        # Fallbacks: check top-level cue/start
+        if cue_start is None:
+            cue_start = data.get('cue') or data.get('start')
+        # Get the media URL
+        if 'audio' in data and '@attributes' in data['audio']:
+            url = data['audio']['@attributes'].get('url', '')
+        else:
+            url = ""
+        return url, cue_start
+    except json.JSONDecodeError:
+        return "", None
+
+async def get_media_url_from_flashplayer(client, popup_url):
+    """Fetch the flashplayer.php page and extract the direct media URL and cue start time."""
     if not popup_url:
         return "", None
     try:
-        response = requests.get(popup_url)
+        response = await client.get(popup_url)
         response.raise_for_status()
-        # Find the playlist-data textarea
-        soup = BeautifulSoup(response.text, 'html.parser')
-        playlist_data = soup.find('textarea', {'id': 'playlist-data'})
-        if not playlist_data:
-            return "", None
-        # Parse the JSON data
-        try:
-            data = json.loads(playlist_data.string.strip())
-            cue_start = None
-            # Prefer the offset field in top-level @attributes
-            if '@attributes' in data and 'offset' in data['@attributes']:
-                cue_start = data['@attributes']['offset']
-            # Fallbacks: check audio attributes for cue/start
-            if cue_start is None and 'audio' in data and '@attributes' in data['audio']:
-                cue_start = data['audio']['@attributes'].get('cue')
-                if cue_start is None:
-                    cue_start = data['audio']['@attributes'].get('start')
-            # Fallbacks: check top-level cue/start
-            if cue_start is None:
-                cue_start = data.get('cue') or data.get('start')
-            # Get the media URL
-            if 'audio' in data and '@attributes' in data['audio']:
-                url = data['audio']['@attributes'].get('url', '')
-            else:
-                url = ""
-            return url, cue_start
-        except json.JSONDecodeError:
-            pass
+        return parse_flashplayer_page(response.content)
     except Exception as e:
         print(f"Error fetching flashplayer page {popup_url}: {e}")
     return "", None
 
-def construct_m3u_url(popup_url):
-    """Construct M3U URL from popup player URL by extracting show and archive IDs."""
-    if not popup_url:
-        return ""
-        
-    try:
-        # Parse the URL and get query parameters
-        parsed = urlparse(popup_url)
-        params = parse_qs(parsed.query)
-        
-        # Extract show and archive IDs
-        show_id = params.get('show', [''])[0]
-        archive_id = params.get('archive', [''])[0]
-        
-        if show_id and archive_id:
-            return f"https://www.wfmu.org/listen.m3u?show={show_id}&archive={archive_id}"
-    except Exception:
-        pass
-        
-    return ""
-
-def get_mp3_url_from_m3u(m3u_url):
+async def get_mp3_url_from_m3u(client, m3u_url):
     """Download and parse M3U file to get the actual MP3 stream URL."""
     if not m3u_url:
         return ""
         
     try:
-        response = requests.get(m3u_url, timeout=10)
+        response = await client.get(m3u_url)
         response.raise_for_status()
         
         # M3U files are typically plain text with one URL per line
         # We'll take the first non-empty, non-comment line
-        for line in response.text.splitlines():
+        for line in response.content.splitlines():
             line = line.strip()
-            if line and not line.startswith('#'):
-                return line
+            if line and line[0:1] != b'#':
+                return line.decode('utf-8', errors='replace')
     except Exception as e:
         print(f"Error fetching M3U file {m3u_url}: {e}")
         
     return ""
 
-def get_s3_url_from_rtmp(rtmp_url):
-    """Convert RTMP URL to S3 URL."""
-    if not rtmp_url:
-        return None
-    # Extract filename from RTMP URL (e.g., lm250424.mp4)
-    filename_match = re.search(r'mp4:LM/([^"]+)', rtmp_url)
-    if filename_match:
-        filename = filename_match.group(1)
-        # Construct S3 URL
-        return f"https://s3.amazonaws.com/arch.wfmu.org/LM/{filename}"
+def get_s3_url_from_date(date_str):
+    """Build the S3 URL for the archive named after the show date (e.g., April 24, 2025 -> lm250424.mp4)."""
+    for date_format in ('%B %d %Y', '%b %d %Y'):
+        try:
+            show_date = datetime.strptime(date_str.replace(',', ''), date_format)
+        except ValueError:
+            continue
+        return f"https://s3.amazonaws.com/arch.wfmu.org/LM/lm{show_date:%y%m%d}.mp4"
     return None
 
-def scrape_wfmu_playlists():
-    # URL to scrape
-    url = "https://www.wfmu.org/playlists/LM"
-    
+def load_previous_entries(output_path):
+    """Load the entries of the last scrape, keyed by (show_id, archive_id)."""
     try:
-        # Download the webpage
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        
-        # Save the raw HTML to a file
-        html_output_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "wfmu_playlist_page.html")
-        with open(html_output_path, 'w', encoding='utf-8') as f:
-            f.write(response.text)
-        print(f"Raw HTML saved to: {html_output_path}")
-        
-        # Parse the HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find all list items that contain playlist entries
-        playlist_items = []
-        
-        # Regular expression to match the date and title format
-        date_pattern = re.compile(r'([A-Za-z]+ \d+,? (\d{4}))')
+        raw = output_path.read_bytes()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
+    except (OSError, ValueError):
+        return {}
+    return {(entry.get("show_id"), entry.get("archive_id")): entry for entry in data.get("playlists", [])}
+
+async def process_entry(client, semaphore, entry, previous=None):
+    """Fill in an entry's media URLs, reusing the last scrape's or fetching the flashplayer page and M3U file concurrently."""
+    # Archived shows never change, so reuse what the last run resolved
+    if previous and previous.get("direct_media_url"):
+        for key in RESOLVED_FIELDS:
+            entry[key] = previous.get(key, entry[key])
+        return entry
+    
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+    
+    # Both helpers log and swallow their own errors, so one bad entry can't sink the batch
+    (direct_media_url, cue_start), mp3_url = await asyncio.gather(
+        bounded(get_media_url_from_flashplayer(client, entry["popup_listen_url"])),
+        bounded(get_mp3_url_from_m3u(client, entry["m3u_url"]))
+    )
+    entry["direct_media_url"] = direct_media_url
+    # Convert RTMP URL to S3 URL
+    entry["mp4_listen_url"] = get_s3_url_from_rtmp(direct_media_url)
+    entry["mp3_url"] = mp3_url
+    entry["cue_start"] = cue_start
+    return entry
+
+def parse_playlist_entry(li):
+    """Parse a list item into (year, entry); None if it isn't a dated entry, entry None without show/archive IDs."""
+    if not _IS_PLAYLIST_ENTRY(li):
+        return None
+    
+    # Text of the whole list item, walked once and kept for raw_text
+    li_text = _text(li)
+    
+    # Skip if this doesn't look like a playlist entry
+    date_match = _DATE_RE.search(li_text)
+    if not date_match:
+        return None
         
-        # Counter for limiting entries
-        entry_count = 0
-        max_entries = 4
+    # Extract the date and title
+    date_str = date_match.group(1)
+    year = int(date_match.group(2))
+    
+    # Find the playlist link and listen URLs
+    playlist_link = ""
+    popup_listen_url = ""
+    m3u_url = ""
+    show_id = ""
+    archive_id = ""
+    
+    # Collect the links and the first bold element in one walk of the list item
+    links = []
+    bold = None
+    for node in li.iter('a', 'b'):
+        if node.tag == 'a':
+            links.append(node)
+        elif bold is None:
+            bold = node
+    
+    for link in links:
+        href = link.get('href') or ''
+        link_text = _text(link)
         
-        for li in soup.find_all('li'):
-            text = li.get_text(strip=True)
-            
-            # Skip if this doesn't look like a playlist entry
-            if not date_pattern.search(text):
-                continue
-                
-            # Extract the date and title
-            date_match = date_pattern.search(text)
-            if not date_match:
-                continue
-                
-            date_str = date_match.group(1)
-            year = int(date_match.group(2))
-            
-            # Stop processing if we hit 2024 or earlier
-            if year <= 2024:
-                break
-            
-            # Find the playlist link and listen URLs
-            playlist_link = ""
-            popup_listen_url = ""
-            show_id = ""
-            archive_id = ""
-            
-            # Find all links in the list item
-            links = li.find_all('a')
-            for link in links:
-                href = link.get('href', '')
-                text = link.get_text(strip=True)
-                
-                if "See the playlist" in text:
-                    playlist_link = "https://www.wfmu.org" + href
-                elif "Pop-up" in text or ('flashplayer.php' in href and 'version=3' in href):
-                    # Parse the URL to get show and archive IDs
-                    parsed = urlparse(href)
-                    params = parse_qs(parsed.query)
-                    
-                    # Get the first show and archive ID from the parameters
-                    show_id = params.get('show', [''])[0]
-                    archive_id = params.get('archive', [''])[0]
-                    
-                    if show_id and archive_id:
-                        # Construct the popup URL in the exact format
-                        popup_listen_url = f"https://www.wfmu.org/flashplayer.php?version=3&show={show_id}&archive={archive_id}"
-                        # Once we find a valid flashplayer URL, break to avoid overwriting with other links
-                        break
-            
-            # Skip entries without a popup player URL
-            if not popup_listen_url:
-                continue
-            
-            # Find the title (usually in bold)
-            title = ""
-            bold = li.find('b')
-            if bold:
-                # Remove any links from the bold text to get clean title
-                for a in bold.find_all('a'):
-                    a.decompose()
-                title = bold.get_text(strip=True)
-                # Remove any trailing dots or spaces
-                title = title.rstrip('. ')
+        if "See the playlist" in link_text:
+            playlist_link = "https://www.wfmu.org" + href
+        elif 'listen.m3u' in href:
+            m3u_url = "https://www.wfmu.org" + href
+        elif not popup_listen_url and ("Pop-up" in link_text or ('flashplayer.php' in href and 'version=3' in href)):
+            # Get the show and archive IDs from the URL
+            show_id, archive_id = show_archive_ids(href)
             
-            # Get the direct media URL and cue start from the flashplayer page
-            direct_media_url, cue_start = get_media_url_from_flashplayer(popup_listen_url)
+            if show_id and archive_id:
+                # Construct the popup URL in the exact format; later player links don't overwrite it
+                popup_listen_url = f"https://www.wfmu.org/flashplayer.php?version=3&show={show_id}&archive={archive_id}"
+        
+        # Stop once every link is found; the M3U archive ID can differ from the pop-up's, so it is waited for too
+        if playlist_link and popup_listen_url and m3u_url:
+            break
+    
+    # Skip entries without a popup player URL
+    if not popup_listen_url:
+        return year, None
+    
+    # Find the title (usually in bold)
+    title = ""
+    if bold is not None:
+        # Skip any link text inside the bold to get clean title
+        title = ''.join(
+            fragment.strip() for fragment in bold.xpath('.//text()[not(ancestor::a)]')
+        )
+        # Remove any trailing dots or spaces
+        title = title.rstrip('. ')
+    
+    # Create playlist entry; media URLs are resolved once all entries are collected
+    entry = {
+        "date": date_str,
+        "title": title,
+        "show_id": show_id,
+        "archive_id": archive_id,
+        "playlist_link": playlist_link,
+        "popup_listen_url": popup_listen_url,
+        "m3u_url": m3u_url or construct_m3u_url(popup_listen_url),
+        "direct_media_url": "",
+        "mp4_listen_url": None,
+        "mp3_url": "",
+        "s3_url": get_s3_url_from_date(date_str),
+        "cue_start": None,
+        "raw_text": li_text
+    }
+    
+    return year, entry
+
+async def _iter_list_items(chunks, dump=None, encoding=PAGE_ENCODING):
+    """Parse the streamed page incrementally, yielding each <li> once complete and discarding it afterwards."""
+    parser = etree.HTMLPullParser(events=('end',), tag='li', encoding=encoding)
+    async for chunk in chunks:
+        if dump is not None:
+            dump.write(chunk)
+        parser.feed(chunk)
+        for _, li in parser.read_events():
+            yield li
+            # Free the processed item and everything parsed before it
+            li.clear()
+            while li.getprevious() is not None:
+                del li.getparent()[0]
+    parser.close()
+    for _, li in parser.read_events():
+        yield li
+
+async def scrape_wfmu_playlists_async():
+    # URL to scrape
+    url = "https://www.wfmu.org/playlists/LM"
+    
+    try:
+        # One pooled client serves the index page and every per-entry fetch
+        limits = httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS)
+        async with httpx.AsyncClient(limits=limits, http2=True, headers=HEADERS, timeout=10) as client:
+            # Each entry's media URLs are resolved in the background while the page is still streaming
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            output_path = REPO_ROOT / "wfmu_playlists.json"
+            previous_entries = load_previous_entries(output_path)
+            tasks = []
             
-            # Convert RTMP URL to S3 URL
-            mp4_listen_url = get_s3_url_from_rtmp(direct_media_url)
+            # Counter for limiting entries
+            entry_count = 0
+            max_entries = 4
             
-            # Create playlist entry
-            entry = {
-                "date": date_str,
-                "title": title,
-                "show_id": show_id,
-                "archive_id": archive_id,
-                "playlist_link": playlist_link,
-                "popup_listen_url": popup_listen_url,
-                "direct_media_url": direct_media_url,
-                "mp4_listen_url": mp4_listen_url,
-                "cue_start": cue_start,
-                "raw_text": text
-            }
+            # Stream the webpage into the parser, saving the raw HTML as it arrives when debugging
+            html_output_path = REPO_ROOT / "wfmu_playlist_page.html" if os.getenv("WFMU_DEBUG_DUMP") else None
+            try:
+                async with client.stream('GET', url) as response:
+                    response.raise_for_status()  # Raise an exception for bad status codes
+                    # Written beside the real dump and moved into place once the whole page is saved
+                    partial_path = html_output_path.with_suffix('.html.part') if html_output_path else None
+                    with open(partial_path, 'wb') if partial_path else contextlib.nullcontext() as dump:
+                        chunks = response.aiter_bytes()
+                        encoding = response.charset_encoding or PAGE_ENCODING
+                        async for li in _iter_list_items(chunks, dump, encoding):
+                            parsed = parse_playlist_entry(li)
+                            if parsed is None:
+                                continue
+                            year, entry = parsed
+                            
+                            # Stop processing if we hit 2024 or earlier
+                            if year <= 2024:
+                                break
+                            if entry is None:
+                                continue
+                            
+                            previous = previous_entries.get((entry["show_id"], entry["archive_id"]))
+                            tasks.append(asyncio.create_task(process_entry(client, semaphore, entry, previous)))
+                            
+                            # Increment counter and break if we've reached the limit
+                            entry_count += 1
+                            if entry_count >= max_entries:
+                                break
+
+                        if dump is not None:
+                            # Parsing stops at the cutoff, but the dump should hold the whole page
+                            async for chunk in chunks:
+                                dump.write(chunk)
+            except Exception:
+                # Stop the lookups still using the client before it closes
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            if html_output_path:
+                partial_path.replace(html_output_path)
+                print(f"Raw HTML saved to: {html_output_path}")
             
-            playlist_items.append(entry)
+            # Wait for the remaining lookups; gather keeps the page order
+            playlist_items = await asyncio.gather(*tasks)
             
-            # Increment counter and break if we've reached the limit
-            entry_count += 1
-            if entry_count >= max_entries:
-                break
-        
         # Save to JSON file
-        output_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "wfmu_playlists.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump({
-                "last_updated": datetime.now().isoformat(),
-                "source_url": url,
-                "playlists": playlist_items
-            }, f, indent=2, ensure_ascii=False)
-            
+        payload = {
+            "last_updated": datetime.now(timezone.utc),
+            "source_url": url,
+            "playlists": playlist_items
+        }
+        if orjson:
+            output_path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+        else:
+            output_path.write_text(
+                json.dumps(payload, indent=2, ensure_ascii=False, default=datetime.isoformat), encoding='utf-8'
+            )
+        
         print(f"Successfully scraped {len(playlist_items)} playlist entries from 2025")
         print(f"Data saved to: {output_path}")
         
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error downloading webpage: {e}")
     except Exception as e:
         print(f"Error processing data: {e}")
 
+def scrape_wfmu_playlists():
+    asyncio.run(scrape_wfmu_playlists_async())
+
 if __name__ == "__main__":
     scrape_wfmu_playlists() 
\ No newline at end of file
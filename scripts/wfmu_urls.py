@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import re
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
+
+# Archive filename inside an RTMP URL (e.g., lm250424.mp4)
+_FILENAME_RE = re.compile(r'mp4:LM/([^"]+)')
+# Show and archive IDs of a flashplayer/M3U URL, in either order
+_SHOW_ARCHIVE_RE = re.compile(
+    r'[?&]show=(\d+)&(?:[^&#]*&)*?archive=(\d+)|[?&]archive=(\d+)&(?:[^&#]*&)*?show=(\d+)'
+)
+
+def show_archive_ids(url):
+    """Return the show and archive IDs from a wfmu.org URL's query string."""
+    match = _SHOW_ARCHIVE_RE.search(url)
+    if match:
+        show_id, archive_id, archive_id_first, show_id_last = match.groups()
+        return show_id or show_id_last, archive_id or archive_id_first
+    # Not expected for wfmu.org URLs, but fall back to full query parsing
+    params = parse_qs(urlparse(url).query)
+    return params.get('show', [''])[0], params.get('archive', [''])[0]
+
+@lru_cache(maxsize=1024)
+def construct_m3u_url(popup_url):
+    """Construct M3U URL from popup player URL by extracting show and archive IDs."""
+    if not popup_url:
+        return ""
+        
+    # Extract show and archive IDs
+    show_id, archive_id = show_archive_ids(popup_url)
+    
+    if show_id and archive_id:
+        return f"https://www.wfmu.org/listen.m3u?show={show_id}&archive={archive_id}"
+        
+    return ""
+
+def get_s3_url_from_rtmp(rtmp_url):
+    """Convert RTMP URL to S3 URL."""
+    if not rtmp_url:
+        return None
+    # Extract filename from RTMP URL (e.g., lm250424.mp4)
+    filename_match = _FILENAME_RE.search(rtmp_url)
+    if filename_match:
+        filename = filename_match.group(1)
+        # Construct S3 URL
+        return f"https://s3.amazonaws.com/arch.wfmu.org/LM/{filename}"
+    return None